@@ -2,11 +2,19 @@ import sqlite3
 import sys
 from pathlib import Path
 
+import matplotlib
+import numpy as np
 import pandas as pd
+
+# Only writing image files: use the non-interactive backend before
+# pyplot is imported (seaborn imports it too)
+matplotlib.use("Agg")
+# pylint: disable=wrong-import-position
 import seaborn as sns
 from matplotlib import pyplot as plt
 
 from simulation_config import SimulationConfig
+# pylint: enable=wrong-import-position
 
 CONFIG_FILE = "simulation.ini"
 IMG_FILES_ROOT = "simulation"
@@ -17,6 +25,14 @@ GREEN = "\033[32m"
 NORMAL = "\033[0m"
 HIGHLIGHT = GREEN
 
+# Read-only workload: in-memory temporary storage for the group by's,
+# a 64MB page cache and memory-mapped I/O
+SQLITE_PRAGMAS = """
+    pragma temp_store = MEMORY;
+    pragma cache_size = -65536;
+    pragma mmap_size = 268435456;
+"""
+
 
 class Plotter:
     def __init__(self, config_file):
@@ -25,10 +41,24 @@ class Plotter:
         self.services = ["registration", "triage", "ed", "acu"]
 
     def init_db(self):
-        self.db = sqlite3.connect(self.config.db_filename)
+        self.db = sqlite3.connect(self.config.db_filename, isolation_level=None)
+        self.db.executescript(SQLITE_PRAGMAS)
 
     def load_queues(self, bin_size):
-        sql = f"select round(timestamp/{bin_size}) as hour, avg(q_len) as q_len, service  from {self.config.db_queues_table} where hour > {self.config.warm_up_time/bin_size} group by hour,service;"
+        """read the queues table into a dataframe
+
+        The queue lengths are only recorded after the warm-up, the bin straddling
+        its end is still left out as it holds only half a bin of data.
+        The hours are shifted so the plot starts at the end of the warm-up
+        and are scaled to hours rather than minutes
+        """
+
+        warm_up_bins = self.config.warm_up_time / bin_size
+        sql = f"""select (round(timestamp/{bin_size}) - {warm_up_bins}) * {bin_size / 60} as hour,
+            avg(q_len) as q_len, service
+            from {self.config.db_queues_table} where round(timestamp/{bin_size}) > {warm_up_bins}
+            group by round(timestamp/{bin_size}), service;
+            """
         return pd.read_sql(sql, self.db)
 
     def load_patients(self, bin_size):
@@ -39,18 +69,36 @@ class Plotter:
         The dataframe columns are: service, hour, wait_time
         This regular form allows us to use service as hue to the lineplot
         The wait times are are averaged across each run and for each bin_size eg 15'
+        The hours start at the end of the warm-up and, like the wait times,
+        are in hours rather than minutes
         """
 
-        dfs = []
-        for service in self.services:
-            sql = f"""select "{service}" as service, round(registration_entry/{bin_size}) as hour,
-                avg({service}_start - {service}_entry) as wait_time
-                from {self.config.db_patients_table}  group by hour;
-                """
-            dfs.append(pd.read_sql(sql, self.db))
-
-        # concatenating dataframes is expensive, only do it once
-        return pd.concat(dfs, ignore_index=True)
+        # Scan the table once, computing the wait for every service as its own
+        # column, then lay the service columns end to end into the regular form
+        waits = ", ".join(
+            f"avg({service}_start - {service}_entry) / 60.0 as {service}"
+            for service in self.services
+        )
+        warm_up_bins = self.config.warm_up_time / bin_size
+        sql = f"""select (round(registration_entry/{bin_size}) - {warm_up_bins}) * {bin_size / 60} as hour,
+            {waits}
+            from {self.config.db_patients_table} where registration_entry >= {self.config.warm_up_time}
+            group by round(registration_entry/{bin_size});
+            """
+
+        # Fetch straight into a float array (NULL waits become NaN) and build the
+        # dataframe from columns, bypassing read_sql's row-by-row construction
+        n_services = len(self.services)
+        rows = self.db.execute(sql).fetchall()
+        waits_arr = np.array(rows, dtype=float).reshape(-1, n_services + 1)
+        n_hours = len(waits_arr)
+        return pd.DataFrame(
+            {
+                "service": np.repeat(self.services, n_hours),
+                "hour": np.tile(waits_arr[:, 0], n_services),
+                "wait_time": waits_arr[:, 1:].T.ravel(),
+            }
+        )
 
     def plot_queue_box(self, ax):
         queues_df = self.load_queues(bin_size=1)
@@ -60,7 +108,6 @@ class Plotter:
 
     def plot_waits_box(self, ax):
         waits_df = self.load_patients(bin_size=1)
-        waits_df.wait_time /= 60
         sns.boxplot(
             ax=ax, data=waits_df, x="service", y="wait_time", order=self.services
         ).set(title="Wait times", ylabel="Wait time (hours)")
@@ -71,12 +118,6 @@ class Plotter:
         # load the data from SQLite DB into a Pandas dataframe
         queues_df = self.load_queues(bin_size=self.config.plot_time_bin_size)
 
-        # Subtract the warm-up duration from timestamps, so plot starts at 0
-        queues_df.hour -= self.config.warm_up_time / self.config.plot_time_bin_size
-
-        # Scale the x-axis to hours rather than minutes
-        queues_df.hour /= 60 / self.config.plot_time_bin_size
-
         # Draw the plot on the axis
         sns.lineplot(
             ax=ax,
@@ -90,9 +131,6 @@ class Plotter:
     def plot_waits(self, ax):
         ax.set(title="Waiting times", ylabel="Wait times (hours)")
         waits_df = self.load_patients(self.config.plot_time_bin_size)
-        waits_df.hour -= self.config.warm_up_time / self.config.plot_time_bin_size
-        waits_df.hour /= 60 / self.config.plot_time_bin_size
-        waits_df.wait_time /= 60  # turn minutes into hours
         sns.lineplot(
             ax=ax,
             data=waits_df,
@@ -104,29 +142,27 @@ class Plotter:
 
         # Report the quantile
         quantile = 0.95
+        quantiles = waits_df.groupby("service").wait_time.quantile(quantile)
         for service in self.services:
-            service_df = waits_df[waits_df.service == service]
             text = f"{service} wait {quantile * 100:.0f}th percentile: "
-            print(f"{text:>40}{service_df.wait_time.quantile(quantile):5.2f} hours")
+            print(f"{text:>40}{quantiles[service]:5.2f} hours")
         print()
 
     def plot_time_series(self):
-        fig, ax = plt.subplots(
-            2, 1, constrained_layout=False, figsize=(20, 15), sharex=True
-        )
+        fig, ax = plt.subplots(2, 1, figsize=(20, 15), sharex=True)
         fig.suptitle("Simulation results")
         self.plot_queues(ax[0])
         self.plot_waits(ax[1])
-        plt.savefig(f"{IMG_FILES_ROOT}_results.png", dpi=300)
+        fig.savefig(f"{IMG_FILES_ROOT}_results.png", dpi=150)
+        plt.close(fig)
 
     def plot_variability(self):
-        fig, ax = plt.subplots(
-            2, 1, constrained_layout=False, figsize=(20, 15), sharex=False
-        )
+        fig, ax = plt.subplots(2, 1, figsize=(20, 15), sharex=False)
         fig.suptitle("Simulation results")
         self.plot_queue_box(ax[0])
         self.plot_waits_box(ax[1])
-        plt.savefig(f"{IMG_FILES_ROOT}_variablility.png", dpi=300)
+        fig.savefig(f"{IMG_FILES_ROOT}_variablility.png", dpi=150)
+        plt.close(fig)
 
     def plot_results(self):
         try:
@@ -4,18 +4,35 @@ Patients arrive and are registered, then move to triage
 after triage they go either to ed or acu service and then exit
 """
 
-from itertools import count
+from array import array
+from itertools import count, repeat
+from operator import attrgetter
 from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import Pool
 import random
 import sqlite3
 
 from simpy import Resource, Environment
-import pandas as pd
 
 from simulation_config import SimulationConfig
 
-Team = namedtuple("Team", "pool service_time")
-DataPoint = namedtuple("DataPoint", "timestamp q_len")
+Team = namedtuple("Team", "pool rate")
+
+# Tune SQLite for bulk inserts: write-ahead log with relaxed syncing, in-memory
+# temporary storage and a 64MB page cache
+SQLITE_PRAGMAS = """
+    pragma journal_mode = WAL;
+    pragma synchronous = NORMAL;
+    pragma temp_store = MEMORY;
+    pragma cache_size = -65536;
+    pragma mmap_size = 268435456;
+"""
+
+# Insert statements, formatted once with the table names so sqlite's statement
+# cache is hit on every executemany. One placeholder per table column
+INSERT_PATIENT_SQL = "insert into {} values (" + ",".join("?" * 16) + ");"
+INSERT_QUEUE_SQL = "insert into {} values (" + ",".join("?" * 4) + ");"
 
 
 class MonitoredResource(Resource):
@@ -26,20 +43,30 @@ class MonitoredResource(Resource):
     Copies the technique described in the SimPy docs - to provide a dynamic visualization the
     queue lengths, # resources occupied etc could be injected into a database, then use visualization
     software to display.
+
+    The timestamps and queue lengths are kept in two parallel typed arrays
+    rather than a list of tuples.
+    Nothing is recorded until monitoring is enabled i.e. at the end of the warm-up
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.stats = []
+        self.enabled = False
+        self.timestamps = array("d")
+        self.q_lens = array("i")
 
     # implicitly called at entry of "with" block
     def request(self, *args, **kwargs):
-        self.stats.append(DataPoint(self._env.now, len(self.queue)))
+        if self.enabled:
+            self.timestamps.append(self._env.now)
+            self.q_lens.append(len(self.queue))
         return super().request(*args, **kwargs)
 
     # implicitly called at exit of "with" block
     def release(self, *args, **kwargs):
-        self.stats.append(DataPoint(self._env.now, len(self.queue)))
+        if self.enabled:
+            self.timestamps.append(self._env.now)
+            self.q_lens.append(len(self.queue))
         return super().release(*args, **kwargs)
 
 
@@ -47,12 +74,60 @@ class MonitoredResource(Resource):
 class Patient:
     """
     Patient: the entity that goes through the system
+
+    The time of each step is kept in a fixed slot rather than in a dict.
+    Steps the patient didn't go through (or didn't finish) remain None
+
+    The slots are in the same order as the columns of the patients table
     """
 
-    def __init__(self, patient_id, p_ed):
+    __slots__ = (
+        "id",
+        "is_for_ed",
+        "registration_entry",
+        "registration_start",
+        "registration_exit",
+        "triage_entry",
+        "triage_start",
+        "triage_exit",
+        "ed_entry",
+        "ed_start",
+        "ed_exit",
+        "acu_entry",
+        "acu_start",
+        "acu_exit",
+        "exit",
+    )
+
+    def __init__(self, patient_id, p_ed, rng):
         self.id = patient_id
-        self.timestamps = {}
-        self.is_for_ed = random.uniform(0, 1) < p_ed
+        self.is_for_ed = rng.random() < p_ed
+        self.registration_entry = None
+        self.registration_start = None
+        self.registration_exit = None
+        self.triage_entry = None
+        self.triage_start = None
+        self.triage_exit = None
+        self.ed_entry = None
+        self.ed_start = None
+        self.ed_exit = None
+        self.acu_entry = None
+        self.acu_start = None
+        self.acu_exit = None
+        self.exit = None
+
+
+class WarmUpPatient(Patient):
+    """
+    Patient arriving during the warm-up: goes through the system like any other
+    but its stats are never saved, so skips initialising its id & timestamps
+    """
+
+    __slots__ = ()
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, p_ed, rng):
+        self.is_for_ed = rng.random() < p_ed
 
 
 class SurgerySimulation:
@@ -66,6 +141,15 @@ class SurgerySimulation:
         self.patients = []
         self.env = Environment()
 
+        # The exponential distributions take a rate rather than a mean,
+        # do the division once rather than at every event
+        self.arrival_rate = 1.0 / self.config.patient_inter_arrival_time
+
+        # Each simulation draws from its own generator, with its
+        # bound methods cached to save the lookups at every event
+        self._rng = random.Random()
+        self._expovariate = self._rng.expovariate
+
         # Establish staffing levels for each team/service as
         # SimPy Resources (monitoring queue lengths)
         receptionist_pool = MonitoredResource(
@@ -77,13 +161,22 @@ class SurgerySimulation:
             self.env, capacity=self.config.n_acu_doctors
         )
 
-        # Save the team resources and mean service times as a dictionary
-        # of named tuples – keyed on the name of the team
+        # Save the team resources and service rates (1 / mean service time)
+        # as a dictionary of named tuples – keyed on the name of the team
         self.teams = {
-            "registration": Team(receptionist_pool, self.config.reception_service_mean),
-            "triage": Team(nurse_pool, self.config.triage_service_mean),
-            "ed": Team(ed_doctor_pool, self.config.ed_service_mean),
-            "acu": Team(acu_doctor_pool, self.config.acu_service_mean),
+            "registration": Team(
+                receptionist_pool, 1.0 / self.config.reception_service_mean
+            ),
+            "triage": Team(nurse_pool, 1.0 / self.config.triage_service_mean),
+            "ed": Team(ed_doctor_pool, 1.0 / self.config.ed_service_mean),
+            "acu": Team(acu_doctor_pool, 1.0 / self.config.acu_service_mean),
+        }
+
+        # Names of the patient's entry, start & exit timestamps for each service,
+        # built once rather than concatenated at every service call
+        self.step_keys = {
+            service: (f"{service}_entry", f"{service}_start", f"{service}_exit")
+            for service in self.teams
         }
 
     @property
@@ -91,51 +184,102 @@ class SurgerySimulation:
         return self.env.now < self.config.warm_up_time
 
     def generate_patients(self):
+        # local names for everything used at each arrival
+        env = self.env
+        rng = self._rng
+        expovariate = self._expovariate
+        arrival_rate = self.arrival_rate
+        p_ed = self.config.patient_p_ed
+
         for patient_id in count():
-            patient = Patient(patient_id, self.config.patient_p_ed)
-            if not self.is_warming_up:
+            if self.is_warming_up:
+                patient = WarmUpPatient(p_ed, rng)
+            else:
+                patient = Patient(patient_id, p_ed, rng)
                 # keep track of our patient
                 self.patients.append(patient)
 
             # put the patient in the system
-            self.env.process(self.process_patient(patient))
+            env.process(self.process_patient(patient))
 
             # wait until next person to walks in
-            yield self.env.timeout(
-                random.expovariate(1 / self.config.patient_inter_arrival_time)
-            )
+            yield env.timeout(expovariate(arrival_rate))
 
     def process_patient(self, patient):
         """Send the patient through the sequence of steps in the clinic"""
 
         treatment = "ed" if patient.is_for_ed else "acu"
         process_steps = ["registration", "triage", treatment]
-        for step in process_steps:
-            yield from self.do_service(patient, step)
-        patient.timestamps["exit"] = self.env.now
+        teams = self.teams
+        for step, team in [(step, teams[step]) for step in process_steps]:
+            yield from self.do_service(patient, step, team)
+        patient.exit = self.env.now
 
-    def do_service(self, patient, service_name):
+    def do_service(self, patient, service_name, team):
         """
         Generic service call:
-        Waits for the service resource to be available
+        Waits for the service resource (team.pool) to be available
         Then waits for the service to complete
         The patient logs the time at each stage: entry, start, exit
         """
 
-        patient.timestamps[service_name + "_entry"] = self.env.now
-        resource = self.teams[service_name].pool
-        service_time = self.teams[service_name].service_time
-        with resource.request() as request:
+        env = self.env
+        entry_key, start_key, exit_key = self.step_keys[service_name]
+        setattr(patient, entry_key, env.now)
+        with team.pool.request() as request:
             yield request
-            patient.timestamps[service_name + "_start"] = self.env.now
-            yield self.env.timeout(random.expovariate(1 / service_time))
-            patient.timestamps[service_name + "_exit"] = self.env.now
+            setattr(patient, start_key, env.now)
+            yield env.timeout(self._expovariate(team.rate))
+            setattr(patient, exit_key, env.now)
+
+    def enable_monitoring_after_warm_up(self):
+        yield self.env.timeout(self.config.warm_up_time)
+        for team in self.teams.values():
+            team.pool.enabled = True
 
     def run(self):
         total_run_time = self.config.warm_up_time + self.config.simulation_time
+        self.env.process(self.enable_monitoring_after_warm_up())
         self.env.process(self.generate_patients())
         self.env.run(until=total_run_time)
 
+    def patient_stats(self):
+        """The statistics of each patient, as rows of the patients table"""
+
+        # some values may be None i.e. patients that didn't make it the
+        # whole way through the system and because ed & acu are exclusive
+        #
+        # The Patient slots MUST be in the same order as the columns of the patients table
+        # and attrgetter pulls all the attributes of a patient in a single C call
+        get_stats = attrgetter(*Patient.__slots__)
+        run_id = (self.run_id,)
+        return [run_id + get_stats(p) for p in self.patients]
+
+    def queue_stats(self):
+        """The queue lengths of each team, as rows of the queues table"""
+
+        rows = []
+        for service, team in self.teams.items():
+            rows += zip(
+                repeat(self.run_id),
+                repeat(service),
+                team.pool.timestamps,
+                team.pool.q_lens,
+            )
+        return rows
+
+
+def run_simulation(job):
+    """
+    Execute a single run in a worker process: no database access,
+    the stats are returned to the driver as lists of rows
+    """
+
+    run_id, config = job
+    simulation = SurgerySimulation(run_id, config)
+    simulation.run()
+    return simulation.patient_stats(), simulation.queue_stats()
+
 
 class SimulationDriver:
     """
@@ -146,114 +290,101 @@ class SimulationDriver:
     def __init__(self, config_filename, drop_tables=True):
         self.config = SimulationConfig(config_filename)
         self.init_db(drop_tables)
-        self.simulation = None
+        self.insert_patient_sql = INSERT_PATIENT_SQL.format(
+            self.config.db_patients_table
+        )
+        self.insert_queue_sql = INSERT_QUEUE_SQL.format(self.config.db_queues_table)
 
     def init_db(self, drop_tables):
-        self.db = sqlite3.connect(self.config.db_filename)
+        # autocommit mode: transactions are driven explicitly, see transaction()
+        self.db = sqlite3.connect(self.config.db_filename, isolation_level=None)
+        self.db.executescript(SQLITE_PRAGMAS)
+        cur = self.db.cursor()
         if drop_tables:
-            cur = self.db.cursor()
             for table in [self.config.db_patients_table, self.config.db_queues_table]:
                 sql = f"drop table if exists {table};"
                 cur.execute(sql)
-            cur.close()
 
-    def save_stats(self):
-        self.save_queue_lengths()
-        self.save_patient_stats()
+        # Create the tables up-front so the stats can be bulk inserted with executemany
+        cur.execute(
+            f"""create table if not exists {self.config.db_patients_table} (
+                run_id integer,
+                patient_id integer,
+                is_for_ed integer,
+                registration_entry real,
+                registration_start real,
+                registration_exit real,
+                triage_entry real,
+                triage_start real,
+                triage_exit real,
+                ed_entry real,
+                ed_start real,
+                ed_exit real,
+                acu_entry real,
+                acu_start real,
+                acu_exit real,
+                exit real
+            );"""
+        )
+        cur.execute(
+            f"""create table if not exists {self.config.db_queues_table} (
+                run_id integer,
+                service text,
+                timestamp real,
+                q_len integer
+            );"""
+        )
+        cur.close()
 
-    def save_patient_stats(self):
-        """Save the patient statistics to sqlite at the end of each run"""
+    @contextmanager
+    def transaction(self):
+        """Run the enclosed statements in a single transaction, rolled back on error"""
 
-        # create a list of stats for each patient in the run
-        #
-        # use dict.get() as some values may be None i.e. patients that didn't
-        # make it the whole way through the system and because ed & acu are exclusive
-        rows = [
-            (
-                self.simulation.run_id,
-                p.id,
-                p.is_for_ed,
-                p.timestamps.get("registration_entry"),
-                p.timestamps.get("registration_start"),
-                p.timestamps.get("registration_exit"),
-                p.timestamps.get("triage_entry"),
-                p.timestamps.get("triage_start"),
-                p.timestamps.get("triage_exit"),
-                p.timestamps.get("ed_entry"),
-                p.timestamps.get("ed_start"),
-                p.timestamps.get("ed_exit"),
-                p.timestamps.get("acu_entry"),
-                p.timestamps.get("acu_start"),
-                p.timestamps.get("acu_exit"),
-                p.timestamps.get("exit"),
-            )
-            for p in self.simulation.patients
-        ]
-
-        # These columns MUST be in the same order as the above tuples
-        columns = [
-            "run_id",
-            "patient_id",
-            "is_for_ed",
-            "registration_entry",
-            "registration_start",
-            "registration_exit",
-            "triage_entry",
-            "triage_start",
-            "triage_exit",
-            "ed_entry",
-            "ed_start",
-            "ed_exit",
-            "acu_entry",
-            "acu_start",
-            "acu_exit",
-            "exit",
-        ]
-
-        df = pd.DataFrame(data=rows, columns=columns)
-        df.to_sql(
-            self.config.db_patients_table,
-            self.db,
-            index=False,
-            method="multi",
-            if_exists="append",
-        )
-        self.db.commit()
+        self.db.execute("begin immediate;")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("rollback;")
+            raise
+        self.db.execute("commit;")
 
-    def save_queue_lengths(self):
-        """Save the queue statistics to sqlite at the end of each run"""
+    def save_stats(self, patient_rows, queue_rows):
+        self.save_queue_lengths(queue_rows)
+        self.save_patient_stats(patient_rows)
 
-        rows = []
-        for service, team in self.simulation.teams.items():
-            data = [
-                {
-                    "run_id": self.simulation.run_id,
-                    "service": service,
-                    "timestamp": d.timestamp,
-                    "q_len": d.q_len,
-                }
-                for d in team.pool.stats
-            ]
-            rows += data
-        df = pd.DataFrame(rows)
-        df.to_sql(
-            self.config.db_queues_table,
-            self.db,
-            index=False,
-            method="multi",
-            if_exists="append",
-        )
-        self.db.commit()
+    def save_patient_stats(self, rows):
+        """Save the patient statistics of a run to sqlite"""
+
+        self.db.executemany(self.insert_patient_sql, rows)
 
-    def run_once(self, run_id):
-        self.simulation = SurgerySimulation(run_id, self.config)
-        self.simulation.run()
-        self.save_stats()
+    def save_queue_lengths(self, rows):
+        """Save the queue statistics of a run to sqlite"""
+
+        self.db.executemany(self.insert_queue_sql, rows)
 
     def run(self):
+        """
+        The runs are independent so are spread across a pool of worker processes.
+        The workers only simulate, the stats they return are saved here as they arrive
+        """
+
         try:
-            for run_id in range(self.config.n_sims):
-                self.run_once(run_id)
+            # single transaction for the stats of all the runs: only one commit to disk
+            # The workers are forked first: they mustn't inherit an open transaction
+            with Pool() as pool, self.transaction():
+                jobs = ((run_id, self.config) for run_id in range(self.config.n_sims))
+                for patient_rows, queue_rows in pool.imap_unordered(
+                    run_simulation, jobs
+                ):
+                    self.save_stats(patient_rows, queue_rows)
+            # Covering index for the queue lengths plot query, built once the
+            # data is loaded so the inserts don't have to maintain it
+            self.db.execute(
+                f"""create index if not exists ix_queues_ts_service
+                    on {self.config.db_queues_table}(timestamp, service, q_len);"""
+            )
+            # refresh the planner statistics so the plot queries use the index
+            self.db.execute("analyze;")
         finally:
             self.db.close()
 